@@ -1,5 +1,6 @@
 """BH_p-value_adjuster.py: Written by Phil Wilmarth, OHSU.
-Applies a Benjamini-Hochberg correcion to a list of p-values.
+Applies a Benjamini-Hochberg correcion to one or more columns of p-values.
+Requires numpy and pandas.
 adapted from:
 http://stats.stackexchange.com/questions/870/multiple-hypothesis-testing-correction-with-benjamini-hochberg-p-values-or-q-va
 Copyright 2013, Oregon Health & Science University.
@@ -30,16 +31,22 @@ ANY PATENT, TRADEMARK OR OTHER RIGHTS.
 #
 # Python Tkinter program for doing BH adjusted p-values
 # written by Phil Wilmarth, OHSU, 2013
+# updated to adjust multiple p-value columns at once
 #
 from tkinter import *
+import io
 import os
 import sys
 import math
+
+import numpy as np
+import pandas as pd
 #
 # create some globals
 #
-original = []
-adjusted = []
+original = pd.DataFrame()
+adjusted = pd.DataFrame()
+MAX_DISPLAY = 1000  # maximum number of rows echoed to the window
 #
 # status bar class
 #
@@ -66,69 +73,105 @@ class StatusBar(Frame):
 # toolbar button functions
 #
 def get_data():
-    """Gets numerical data from the clipboard
+    """Gets a block of p-value columns from the clipboard
     """
-    global original
-    header = []
+    global original, adjusted
     #
     # get data from the clipboard and show it in the window
     #
     contents = root.clipboard_get()
     lines = contents.splitlines()
-    original = []
-    for i, line in enumerate(lines):
-        line = line.replace(',', '').strip() # remove any commas
-        temp = line.split('\t')
-        if len(temp) != 1:
+    adjusted = pd.DataFrame()
+    if len(lines) == 0:
+        original = pd.DataFrame()
+        clear_screen()
+        print_data(original)
+        return
+    #
+    # first line is a header if it has text above a column of numbers
+    #
+    has_header = find_header(lines)
+    try:
+        original = pd.read_csv(io.StringIO(contents), sep='\t', thousands=',',
+                               header=0 if has_header else None,
+                               skip_blank_lines=False)
+    except (pd.errors.ParserError, ValueError):
+        original = pd.DataFrame()
+        clear_screen()
+        text.insert("1.0", "WARNING: clipboard data could not be read as columns!\n"
+                    "Copy a rectangular block of p-value columns.")
+        status.set("%s", "Clipboard data could not be read")
+        return
+    #
+    # a header one cell short makes pandas use the first column as row names
+    # (fine for R write.table style gene names, not for numbers)
+    #
+    if not isinstance(original.index, pd.RangeIndex):
+        if pd.api.types.is_numeric_dtype(original.index):
+            original = pd.DataFrame()
             clear_screen()
-            text.insert("1.0", "WARNING: data should be a single column!")
+            text.insert("1.0", "WARNING: header row has fewer columns than the data!")
+            status.set("%s", "Header row is missing a column")
             return
-        try:
-            original.append([i, float(temp[0])])
-        except ValueError:
-            header = temp
+        original = original.reset_index(drop=True)
+    #
+    # anything that is not a number (blanks, NA, #N/A, etc.) is missing
+    #
+    text_columns = original.select_dtypes(exclude='number').columns
+    original[text_columns] = original[text_columns].apply(pd.to_numeric, errors='coerce')
+    if not has_header:
+        if len(original.columns) == 1:
+            original.columns = ['p-value']
+        else:
+            original.columns = ['p-value %d' % (i+1) for i in range(len(original.columns))]
+    original.index = np.arange(len(original)) + (1 if has_header else 0)   # clipboard line numbers
+    num_pasted = len(original.columns)
+    original = original.dropna(axis=1, how='all')   # text or empty columns
+    #
+    # skip columns that cannot be p-values (log ratios, counts, etc.)
+    #
+    out_of_range = ((original < 0.0) | (original > 1.0)).any()
+    skipped = [str(col) for col in original.columns[out_of_range]]
+    original = original.loc[:, ~out_of_range]
     clear_screen()
-    print_data(header, original)
-#    print 'length of xy data:', len(xy_data)
-    status.set("%s", "%s lines read from clipboard" % len(lines))
+    print_data(original)
+    if skipped:
+        text.insert("1.0", "WARNING: skipped columns with values outside 0 to 1: %s\n\n" %
+                    ', '.join(skipped))
+    message = "%s lines, %s columns read from clipboard" % (len(lines), len(original.columns))
+    if num_pasted > len(original.columns):
+        message += " (%s columns skipped)" % (num_pasted - len(original.columns))
+    status.set("%s", message)
 #        
 def compute():
-    """Computes BH adjusted p-values
+    """Computes BH adjusted p-values for each column
     """
-    global original
+    global original, adjusted
     clear_data()
-    if len(original) == 0:
+    if original.empty:
        text.insert("1.0", 'WARNING: data needs to be loaded first!')
        return
     #
-    # sort by increasing p-value and compute adjusted p-values
-    #
-    prev_bh_value = 0.0
-    num_total_tests = float(len(original))
-    original = [[x[-1]]+x for x in original]    # prefix p-values to lists
-    original.sort()     # sort by increasing p-values
-    for i, orig_list in enumerate(original):
-        p_value = orig_list[-1]
-        bh_value = (p_value * num_total_tests) / float(i+1)
-        bh_value = min(bh_value, 1.0)
-        bh_value = max(bh_value, prev_bh_value)     # makes BH values monotonic
-        prev_bh_value = bh_value
-        orig_list.append(bh_value)
-##        if i < 10:
-##            print 'p-val', p_value
-##            print 'BH', (p_value * num_total_tests) / float(i+1)
-##            print i, p_value, bh_value
+    # adjust all columns at once and interleave with the original p-values
     #
-    # put back in original order
-    #
-    original = [x[1:] for x in original]
-    original.sort()
+    p_values = original.to_numpy(dtype=float)
+    block = np.empty((p_values.shape[0], 2 * p_values.shape[1]), order='F')
+    block[:, 0::2] = p_values
+    block[:, 1::2] = bh_adjust(p_values)
+    labels = []
+    for col in original.columns:
+        if len(original.columns) == 1:
+            labels += [col, 'BH_adjusted']
+        else:
+            labels += [col, '%s BH_adjusted' % col]
+    adjusted = pd.DataFrame(block, columns=labels)
     #
-    # print Z-scores vector to console and to clipboard
+    # print table to window and to clipboard
     #
     root.clipboard_clear()
-    print_results(original)
-    status.set("%s", "%s p-values were adjusted" % len(original))
+    print_results(adjusted)
+    status.set("%s", "%s p-values in %s columns were adjusted" %
+               (original.count().sum(), len(original.columns)))
 #
 def clear_screen():
     """Clears the window
@@ -150,11 +193,15 @@ def print_help():
     clear_screen()
     help_text = \
 """Computes Benjanini-Hochberg adjusted p-values. P-values are input
-via the clipboard from an Excel sheet. P-values should be displayed
+via the clipboard from an Excel sheet. One or more columns of p-values
+can be copied (with or without a header row). P-values should be displayed
 many decimal places or using scientific notation. P=values do not have
-to be sorted. The number of tests will be the number of p-values.
-Output is original p-values and adjusted p-values displayed in window
-and written to the clipboard.
+to be sorted. Each column is adjusted separately and the number of tests
+will be the number of p-values in that column. Blank or non-numeric cells
+are treated as missing and are left blank in the output. Columns with
+values outside 0 to 1 (fold changes, counts, etc.) are skipped. Output is the
+original p-values and adjusted p-values (side by side for each column)
+displayed in window and written to the clipboard.
 
 Written by Phil Wilmarth, OHSU, 2013."""
     text.insert("1.0", help_text)
@@ -165,31 +212,138 @@ def quit_me():
 #
 # other functions
 #
-def print_data(header, original):
+def is_number(cell):
+    """True if a clipboard cell is a finite number ("nan" and "inf" are text)
+    """
+    try:
+        return math.isfinite(float(cell.replace(',', '')))
+    except ValueError:
+        return False
+#
+def find_header(lines, num_rows=10):
+    """Decides if the first clipboard line is a header by comparing it
+    to the next few lines. It is a header if any column has text above
+    numbers, or a number outside 0 to 1 (a numbered label) above p-values.
+    A single line is a header if it has no numbers.
+    """
+    first = lines[0].split('\t')
+    rows = [line.split('\t') for line in lines[1:num_rows+1]]
+    if len(rows) == 0:
+        return not any(is_number(cell) for cell in first)
+    for i, cell in enumerate(first):
+        below = [float(row[i].replace(',', '')) for row in rows
+                 if i < len(row) and is_number(row[i])]
+        if cell.strip() == '' or len(below) == 0:
+            continue
+        if not is_number(cell):
+            return True
+        label = float(cell.replace(',', ''))
+        if not 0.0 <= label <= 1.0 and all(0.0 <= x <= 1.0 for x in below):
+            return True
+    return False
+#
+def bh_adjust(p_values):
+    """Computes BH adjusted p-values for each column of a 2-D array.
+    Missing values (NaN) are skipped and the number of tests in each
+    column is the number of non-missing p-values.
+    """
+    # columns are kept contiguous (column-major) so each one sorts in place
+    p_values = np.asfortranarray(p_values, dtype=float)
+    missing = np.isnan(p_values)
+    num_tests = np.maximum(np.sum(~missing, axis=0), 1)
+    sorted_p = np.where(missing, np.inf, p_values)   # missing sort to the end (faster than NaN)
+    #
+    # sort by increasing p-value and compute adjusted p-values
+    #
+    # argsort along axis 0 returns a row-major index array, which makes the
+    # gathers below strided; sorting the transposed view keeps it column-major
+    order = np.argsort(sorted_p.T, axis=1).T
+    bh_values = np.take_along_axis(sorted_p, order, axis=0)
+    bh_values *= num_tests / np.arange(1, len(p_values) + 1)[:, np.newaxis]
+    #
+    # reverse cumulative minimum makes BH values monotonic
+    #
+    bh_values = np.minimum.accumulate(bh_values[::-1], axis=0)[::-1]
+    np.minimum(bh_values, 1.0, out=bh_values)
+    #
+    # put back in original order
+    #
+    adjusted = np.empty_like(bh_values)
+    np.put_along_axis(adjusted, order, bh_values, axis=0)
+    adjusted[missing] = np.nan
+    return adjusted
+#
+def format_values(values, decimals, newline, chunk=4096):
+    """Formats a 2-D block of values like '%0.Nf' as tab-separated lines.
+    Missing values (NaN) are left blank. The fast numpy path only works
+    for values from 0 to 1 (no negative zero) with at least one decimal;
+    anything else is formatted one value at a time with '%0.Nf'.
+    """
+    missing = np.isnan(values)
+    outside = ~missing & (np.signbit(values) | (values > 1.0))
+    if decimals < 1 or outside.any():
+        return ''.join('\t'.join('' if math.isnan(value) else '%0.*f' % (decimals, value)
+                                 for value in row) + newline
+                       for row in values.tolist())
+    widths = [5] * (decimals // 5) + ([decimals % 5] if decimals % 5 else [])
+    fields = [('int', 'S1'), ('dot', 'S1')]
+    fields += [('d%d' % i, 'S%d' % w) for i, w in enumerate(widths)]
+    fields += [('sep', 'S1')]
+    cell = np.dtype(fields)     # fixed-width text of one value plus separator
+    tables = {w: np.array(['%0*d' % (w, i) for i in range(10**w)], dtype='S%d' % w)
+              for w in set(widths)}
+    pieces = []
+    for start in range(0, len(values), chunk):
+        block = np.ascontiguousarray(values[start:start+chunk])
+        missing = np.isnan(block)
+        scaled = np.where(missing, 0.0, block) * 10.0**decimals
+        rounded = np.rint(scaled)
+        ties = np.abs(np.abs(scaled - rounded) - 0.5) < 1e-5     # let '%f' round near-halves
+        if ties.any():
+            rounded[ties] = [float(('%0.*f' % (decimals, value)).replace('.', ''))
+                             for value in block[ties]]
+        scaled = rounded.astype(np.int64)
+        cells = np.empty(block.shape, dtype=cell)
+        for i in range(len(widths) - 1, -1, -1):
+            scaled, group = np.divmod(scaled, 10**widths[i])
+            cells['d%d' % i] = tables[widths[i]][group]
+        cells['int'] = np.where(scaled > 0, b'1', b'0')
+        cells['dot'] = b'.'
+        cells['sep'] = b'\t'
+        cells['sep'][:, -1] = newline.encode()
+        chars = cells.view(np.uint8).reshape(block.shape + (cell.itemsize,))
+        if missing.any():
+            keep = np.ones(chars.shape, dtype=bool)
+            keep[missing, :-1] = False     # blank cells keep only their separator
+            chars = chars[keep]
+        pieces.append(chars.tobytes())
+    return b''.join(pieces).decode('ascii')
+#
+def print_data(original):
     """echos the data from the clipboard to the window
     """
     text.configure(tabs=("2.5c", NUMERIC))   # set tabs for numbers
-    if len(original) == 0:
-        text.insert("1.0", 'WARNING: Clipboard was empty!')
+    if original.empty:
+        text.insert("1.0", 'WARNING: no p-values found on the clipboard!')
     else:
-        if len(header) == 0:
-            string = 'Row  \t %s\n' % ('p-values')
-        else:
-            string = 'Row  \t %s\n' % (header[0])
-        text.insert("1.0", string)
-        for row in original:
-            text.insert(CURRENT, '%d\t%0.8f\n' % (row[0], row[1]))
-        text.insert(CURRENT, '\n')                
+        text.insert("1.0", original.head(MAX_DISPLAY).to_csv(sep='\t', index_label='Row',
+                                                            float_format='%0.8f'))
+        if len(original) > MAX_DISPLAY:
+            text.insert(END, '... (first %d of %d rows shown)\n' % (MAX_DISPLAY, len(original)))
+        text.insert(END, '\n')
 #
-def print_results(original):
+def print_results(adjusted):
     """prints data to window and clipboard
     """
     text.configure(tabs=("3.1c", NUMERIC, "6.5c", NUMERIC))   # set tabs for numbers
-    text.insert("1.0", 'p-value\t   BH_adjusted\n')
-    root.clipboard_append('p-value\tBH_adjusted\r')
-    for row in original:
-        text.insert(CURRENT, '%0.8f\t%0.8f\n' % (row[1], row[2]))
-        root.clipboard_append('%0.10f\t%0.10f\r' % (row[1], row[2]))
+    header = '\t'.join(adjusted.columns)
+    values = adjusted.to_numpy()
+    text.insert("1.0", header + '\n' + format_values(values[:MAX_DISPLAY], 8, '\n'))
+    if len(adjusted) > MAX_DISPLAY:
+        text.insert(END, '... (first %d of %d rows shown, all rows on clipboard)\n' %
+                    (MAX_DISPLAY, len(adjusted)))
+    root.clipboard_append(header + '\r')
+    root.clipboard_append(format_values(values, 10, '\r'))
 #
 #
 # MAIN program starts here